@@ -0,0 +1,105 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""
+Copyright 2021 Andrew Zuelsdorf
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from libc.stdint cimport uint8_t, uint32_t
+
+import numpy as np
+
+cdef extern from "Python.h":
+    const char* PyUnicode_AsUTF8AndSize(object unicode, Py_ssize_t *size) except NULL
+
+cdef inline Py_ssize_t _skip_spaces(const char *text, Py_ssize_t length, Py_ssize_t position) noexcept:
+    while position < length and (text[position] == c' ' or text[position] == c'\t'):
+        position += 1
+
+    return position
+
+cdef Py_ssize_t _parse_number(const char *text, Py_ssize_t length, Py_ssize_t position, uint32_t max_value, uint32_t *value) except -1:
+    """
+    Parses the decimal number starting at `position` of `text` into `value`.
+    Returns the position just past the number.
+    """
+    cdef uint32_t number = 0
+    cdef Py_ssize_t start = position
+
+    while position < length and c'0' <= text[position] <= c'9' and position - start < 3:
+        number = number * 10 + <uint32_t>(text[position] - c'0')
+        position += 1
+
+    if position == start or number > max_value:
+        raise ValueError(f"Malformed IP CIDR: {text[:length].decode('utf-8')}")
+
+    value[0] = number
+
+    return position
+
+cdef Py_ssize_t _parse_dotted_quad(const char *text, Py_ssize_t length, Py_ssize_t position, uint32_t *value) except -1:
+    """
+    Parses the IP address starting at `position` of `text` into its numeric
+    value. Returns the position just past the IP address.
+    """
+    cdef uint32_t octet
+    cdef uint32_t result = 0
+    cdef int octet_i
+
+    for octet_i in range(4):
+        if octet_i > 0:
+            if position >= length or text[position] != c'.':
+                raise ValueError(f"Malformed IP CIDR: {text[:length].decode('utf-8')}")
+
+            position += 1
+
+        position = _parse_number(text, length, position, 255, &octet)
+
+        result = (result << 8) | octet
+
+    value[0] = result
+
+    return position
+
+def parse_ip_cidrs(list ip_cidrs):
+    """
+    Parses a list of IP CIDRs into parallel arrays of numeric prefix values
+    (uint32) and mask lengths (uint8).
+    """
+    cdef Py_ssize_t num_ip_cidrs = len(ip_cidrs)
+    cdef Py_ssize_t i, length, position
+    cdef const char *text
+    cdef uint32_t value, mask
+
+    prefix_values = np.empty(num_ip_cidrs, dtype=np.uint32)
+    masks = np.empty(num_ip_cidrs, dtype=np.uint8)
+
+    cdef uint32_t[::1] prefix_values_view = prefix_values
+    cdef uint8_t[::1] masks_view = masks
+
+    for i in range(num_ip_cidrs):
+        text = PyUnicode_AsUTF8AndSize(ip_cidrs[i], &length)
+
+        position = _skip_spaces(text, length, 0)
+        position = _parse_dotted_quad(text, length, position, &value)
+
+        if position >= length or text[position] != c'/':
+            raise ValueError(f"Malformed IP CIDR: {ip_cidrs[i]}")
+
+        position = _parse_number(text, length, position + 1, 32, &mask)
+        position = _skip_spaces(text, length, position)
+
+        if position != length:
+            raise ValueError(f"Malformed IP CIDR: {ip_cidrs[i]}")
+
+        prefix_values_view[i] = value
+        masks_view[i] = <uint8_t>mask
+
+    return (prefix_values, masks)
@@ -16,6 +16,45 @@ import ip_address_utils
 import pandas as pd
 import argparse
 
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pacsv
+except ImportError:
+    pa = None
+
+def read_ip_cidrs(input_file_path, country_codes_cased):
+    """
+    Reads the IP CIDRs in CSV file `input_file_path`, keeping only those whose
+    country code is in `country_codes_cased` unless it is empty. Only the
+    columns needed are parsed, using PyArrow if it is installed and pandas
+    otherwise.
+    """
+    columns = ["ip_cidr", "country"] if country_codes_cased else ["ip_cidr"]
+
+    if pa is not None:
+        convert_options = pacsv.ConvertOptions(include_columns=columns, column_types={column: pa.string() for column in columns})
+
+        # inetnum_file_parser.py writes multi-line values such as descr and
+        # remarks as quoted fields with embedded newlines.
+        parse_options = pacsv.ParseOptions(newlines_in_values=True)
+
+        ip_data = pacsv.read_csv(input_file_path, parse_options=parse_options, convert_options=convert_options)
+
+        if country_codes_cased:
+            ip_data = ip_data.filter(pc.is_in(ip_data["country"], value_set=pa.array(sorted(country_codes_cased), type=pa.string())))
+
+        return ip_data["ip_cidr"].to_pylist()
+
+    # Country codes repeat heavily, so a categorical column lets isin() test
+    # each distinct code once instead of comparing every row's string.
+    ip_data = pd.read_csv(input_file_path, usecols=columns, dtype={"country": "category"} if country_codes_cased else None)
+
+    if country_codes_cased:
+        return list(ip_data.loc[ip_data["country"].isin(country_codes_cased), "ip_cidr"])
+
+    return list(ip_data.loc[:, "ip_cidr"])
+
 def main():
     parser = argparse.ArgumentParser(description="Consolidates IP CIDRs that overlap from different CSV files made by 'inetnum_file_parser.py` into one file with one non-overlapping IP CIDR per line. Allows optional downselection by country code to only consolidate the files' IP CIDRs from certain countries.")
 
@@ -28,23 +67,14 @@ def main():
     country_codes = args.country_codes.split(",") if args.country_codes is not None else []
 
     # The database can often have multiple casings for a given country code.
-    country_codes_cased = []
-
-    for country_code in country_codes:
-        country_codes_cased.append(country_code.upper())
-        country_codes_cased.append(country_code.lower())
+    country_codes_cased = frozenset(country_code.upper() for country_code in country_codes) | frozenset(country_code.lower() for country_code in country_codes)
 
     country_ip_cidrs = list()
 
     for input_file_path in args.input_files.split(','):
-        ip_data = pd.read_csv(input_file_path.strip())
-
-        if country_codes_cased:
-            country_ip_cidrs.extend(ip_data.loc[ip_data["country"].isin(country_codes_cased), "ip_cidr"])
-        else:
-            country_ip_cidrs.extend(ip_data.loc[:, "ip_cidr"])
+        country_ip_cidrs.extend(read_ip_cidrs(input_file_path.strip(), country_codes_cased))
 
-    print(f"Found {len(country_ip_cidrs)} CIDRs for country codes {', '.join(country_codes_cased)}")
+    print(f"Found {len(country_ip_cidrs)} CIDRs for country codes {', '.join(sorted(country_codes_cased))}")
 
     consolidated_ip_cidrs = ip_address_utils.consolidate_ip_cidrs(country_ip_cidrs)
 
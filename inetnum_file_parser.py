@@ -12,51 +12,85 @@ limitations under the License.
 """
 
 import sys
+import contextlib
+import csv
 import argparse
-import pandas as pd
+import pathlib
 import sqlite3
 import re
-import os
 import time
 
-from ip_address_utils import get_ip_cidr_from_ips
+from ip_address_utils import MASKS, get_value, value_to_ip
+
+KEY_PATTERN = re.compile(r"[a-zA-Z0-9\-]+")
 
 DEFAULT_BATCH_SIZE = 500000
 DEFAULT_COLUMNS = set(["netname", "mnt-irt", "tech-c", "mnt-routes", "country", "admin-c", "org", "last-modified", "source", "geoloc", "remarks", "mnt-by", "descr", "status", "inetnum", "abuse-c", "language", "mnt-lower", "ip_cidr", "created", "notify", "mnt-domains", "sponsoring-org"])
 
-def save_records(records, columns, sqlite_file_path, csv_file_path):
-    df_dict = {column: list() for column in columns}
+def _inetnum_to_cidr(inetnum):
+    """
+    Gets the minimal IP CIDR that includes the IP address range `inetnum`,
+    given as "<first IP address> - <last IP address>".
+    """
+    first_ip_addr, _, last_ip_addr = inetnum.partition(" - ")
+
+    first_value = get_value(first_ip_addr)
+    last_value = get_value(last_ip_addr) if last_ip_addr else first_value
+
+    mask_len = 32 - (first_value ^ last_value).bit_length()
+
+    return f"{value_to_ip(first_value & MASKS[mask_len][0])}/{mask_len}"
+
+def open_sqlite_database(sqlite_file_path, columns):
+    """
+    Opens SQLite database `sqlite_file_path` for bulk loading and creates the
+    "Data" table with one TEXT column for each of `columns`. The database is
+    rebuilt from scratch on every run, so durability is traded for speed.
+    """
+    # Path.unlink(missing_ok=True) needs Python 3.8.
+    with contextlib.suppress(FileNotFoundError):
+        pathlib.Path(sqlite_file_path).unlink()
+
+    conn = sqlite3.connect(sqlite_file_path)
+
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA journal_mode=MEMORY")
+    conn.execute("PRAGMA temp_store=MEMORY")
+
+    column_definitions = ", ".join(f'"{column}" TEXT' for column in sorted(columns))
+
+    conn.execute(f"CREATE TABLE IF NOT EXISTS Data ({column_definitions})")
+
+    return conn
 
-    for record_i in records:
+def save_records(records, columns, sqlite_conn, csv_writer):
+    """
+    Writes `records` to the SQLite database and/or CSV writer, one row per
+    record with one value for each of `columns`. Each record is replaced by
+    its row as it is converted, and `records` is emptied once the rows are
+    written, so the batch is never held in memory twice.
+    """
+    fieldnames = sorted(columns)
+
+    for i, record_i in enumerate(records):
         # Check for unrecognized column names. Print warning and skip unrecognized columns if there are some.
         unrecognized_columns = set(record_i.keys()).difference(columns)
 
         if unrecognized_columns:
             sys.stderr.write(f"WARNING: Unrecognized column(s) found in record {record_i}: {', '.join(unrecognized_columns)}\nThese columns will be discarded from this record.\n")
 
-        for column in columns:
-            if column in unrecognized_columns:
-                continue
-
-            column_value = record_i.get(column)
-
-            if column_value is None:
-                df_dict[column].append(None)
-            else:
-                df_dict[column].append(str(column_value).strip())
- 
-    df = pd.DataFrame(df_dict)
+        records[i] = tuple(None if record_i.get(column) is None else str(record_i[column]).strip() for column in fieldnames)
 
-    database = sqlite_file_path
+    if sqlite_conn is not None:
+        placeholders = ", ".join("?" for column in fieldnames)
 
-    if database is not None:
-        with sqlite3.connect(database) as conn:
-            df.to_sql("Data", con=conn, if_exists='append', index=False)
+        with sqlite_conn:
+            sqlite_conn.executemany(f"INSERT INTO Data VALUES ({placeholders})", records)
 
-    csv_file = csv_file_path
+    if csv_writer is not None:
+        csv_writer.writerows(records)
 
-    if csv_file is not None:
-        df.to_csv(csv_file, mode='a', index=False)
+    records.clear()
 
 def main():
     start_time = time.time()
@@ -76,24 +110,26 @@ def main():
     if args.csv_file_path is None and args.sqlite_file_path is None:
         parser.error("Neither CSV nor SQLite file path provided. Please provide a SQLite file path, a CSV file path, or both.")
 
-    if args.csv_file_path is not None:
-        if os.path.isfile(args.csv_file_path):
-            os.remove(args.csv_file_path)
+    num_records = 0
 
-    if args.sqlite_file_path is not None:
-        if os.path.isfile(args.sqlite_file_path):
-            os.remove(args.sqlite_file_path)
+    columns = DEFAULT_COLUMNS if columns_downselect is None else columns_downselect
 
-    num_records = 0
+    with contextlib.ExitStack() as output_stack, args.db_inetnum_file_path as inet_file:
+        sqlite_conn = None
+        csv_writer = None
 
-    args = parser.parse_args()
+        if args.sqlite_file_path is not None:
+            sqlite_conn = output_stack.enter_context(contextlib.closing(open_sqlite_database(args.sqlite_file_path, columns)))
 
-    if args.csv_file_path is None and args.sqlite_file_path is None:
-        parser.error("Neither CSV nor SQLite file path provided. Please provide a SQLite file path, a CSV file path, or both.")
+        # Keep the CSV file open for the whole run and write its header once,
+        # rather than reopening it in append mode for every batch. Opening it
+        # for writing also truncates any output from a previous run.
+        if args.csv_file_path is not None:
+            csv_file = output_stack.enter_context(open(args.csv_file_path, mode='w', newline='', encoding='utf-8'))
 
-    df_dict = dict()
+            csv_writer = csv.writer(csv_file, lineterminator="\n")
+            csv_writer.writerow(sorted(columns))
 
-    with args.db_inetnum_file_path as inet_file:
         records = list()
         record = dict()
 
@@ -102,7 +138,7 @@ def main():
         for line in inet_file:
             # RIPE NCC uses # and % to indicate comments or other data not
             # used in records, APNIC uses # to indicate comments.
-            if line.startswith("#") or line.startswith("%"):
+            if line.startswith(("#", "%")):
                 continue
             # A newline means we've encountered a new record. Assuming the old
             # record has data (the previous section wasn't all comments or other
@@ -114,19 +150,18 @@ def main():
                     record = dict()
 
                 if len(records) == args.batch_size:
-                    save_records(records, DEFAULT_COLUMNS if columns_downselect is None else columns_downselect, args.sqlite_file_path, args.csv_file_path)
+                    save_records(records, columns, sqlite_conn, csv_writer)
                     num_records += args.batch_size
-                    records = list()
             else:
-                line_parts = re.findall(r"^([a-zA-Z0-9\-]+)\:(.*)", line.rstrip())
+                key, separator, value = line.rstrip().partition(":")
 
-                if len(line_parts) == 1 and len(line_parts[0]) == 2:
-                    column_name = line_parts[0][0]
+                if separator and KEY_PATTERN.fullmatch(key):
+                    column_name = key
 
                     if columns_downselect is not None and column_name not in columns_downselect:
                         continue
 
-                    column_value = line_parts[0][1]
+                    column_value = value
 
                     if column_name not in record:
                         record[column_name] = column_value
@@ -135,7 +170,7 @@ def main():
 
                     if column_name == "inetnum" and (columns_downselect is None or "ip_cidr" in columns_downselect):
                         if column_value is not None:
-                            record["ip_cidr"] = get_ip_cidr_from_ips(column_value.split(" - "))
+                            record["ip_cidr"] = _inetnum_to_cidr(column_value)
                         else:
                             record["ip_cidr"] = None
                 else:
@@ -143,8 +178,8 @@ def main():
                         record[column_name] += f"\n{line.rstrip()}"
 
         if len(records) > 0:
-            save_records(records, DEFAULT_COLUMNS if columns_downselect is None else columns_downselect, args.sqlite_file_path, args.csv_file_path)
             num_records += len(records)
+            save_records(records, columns, sqlite_conn, csv_writer)
 
     runtime = int(time.time() - start_time)
 
@@ -12,46 +12,70 @@ limitations under the License.
 """
 
 import functools
-import itertools
+import re
+import socket
+import struct
 
-cache = dict()
+import numpy as np
 
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+    def njit(*args, **kwargs):
+        return lambda function: function
+
+# Optional C extension built from _ipcodec.pyx, see README.md.
+try:
+    from _ipcodec import parse_ip_cidrs
+except ImportError:
+    parse_ip_cidrs = None
+
+# (network mask, host mask) for each of the 33 possible IPv4 mask lengths.
+MASKS = tuple(((0xFFFFFFFF << (32 - mask)) & 0xFFFFFFFF, (1 << (32 - mask)) - 1) for mask in range(33))
+
+NETWORK_MASKS = np.array([network_mask for (network_mask, _) in MASKS], dtype=np.uint32)
+
+# Four decimal octets. Unlike inet_aton, leading zeros are not octal and
+# shortened forms such as "1.2.3" are rejected.
+DOTTED_QUAD_PATTERN = r"[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}"
+
+IP_CIDR_PATTERN = rf"[ \t]*{DOTTED_QUAD_PATTERN}/[0-9]{{1,3}}[ \t]*"
+
+@functools.lru_cache(maxsize=1 << 20)
 def get_value(ip_addr):
     """
-    Converts IP address to its numeric value.
+    Converts IP address to its numeric value. The result depends only on
+    `ip_addr`, so it is memoized for addresses that are converted repeatedly.
     """
+    # inetnum values can carry surrounding whitespace.
+    ip_addr = ip_addr.strip()
 
-    ip_num_value = 0
+    if re.fullmatch(DOTTED_QUAD_PATTERN, ip_addr) is None:
+        raise ValueError(f"Malformed IP address: {ip_addr}")
 
-    ip_octets = list(reversed(ip_addr.split(".")))
+    octets = [int(octet) for octet in ip_addr.split(".")]
 
-    for exponent in range(0, 4, 1):
-        ip_num_value += int(ip_octets[exponent]) * (1 << (exponent << 3))
+    if max(octets) > 255:
+        raise ValueError(f"Found IP address octet greater than 255: {ip_addr}")
 
-    return ip_num_value
+    return struct.unpack(">I", bytes(octets))[0]
 
 def get_min_value(prefix, mask):
     """
     Gets numeric value of minimum IP address in an IP CIDR with prefix
     `prefix` and mask `mask`.
     """
-    ip_num_value = get_value(prefix)
-
-    mask_value = sum([(1 << i) for i in range(32 - mask, 32)])
-
-    return ip_num_value & mask_value
+    return get_value(prefix) & MASKS[mask][0]
 
 def get_max_value(min_value, mask):
     """
     Gets numeric value of maximum IP address in an IP CIDR with prefix
     `prefix` and mask `mask`.
     """
-    max_value = min_value
-
-    for i in range(32 - mask):
-        max_value += (1 << i)
-
-    return max_value
+    return min_value | MASKS[mask][1]
 
 def ip_cidr_to_ip_value_range(ip_cidr):
     """
@@ -66,16 +90,87 @@ def ip_cidr_to_ip_value_range(ip_cidr):
 
     return (min_value, max_value)
 
-def ip_cidr_to_ip_range(ip_cidr):
+def _parse_cidr_fields(ip_cidrs):
     """
-    Gets minimum and maximum IP addresses in IP CIDR `ip_cidr`
+    Parses the four octets and the mask length of every IP CIDR in
+    `ip_cidrs` into a uint32 array with one row per IP CIDR and five columns.
+    Raises ValueError if any IP CIDR is malformed.
     """
-    min_value, max_value = ip_cidr_to_ip_value_range(ip_cidr)
+    ip_cidrs = list(ip_cidrs)
+
+    if not ip_cidrs:
+        return np.empty((0, 5), dtype=np.uint32)
+
+    joined_ip_cidrs = "\n".join(ip_cidrs)
+
+    # Check the structure of every IP CIDR in one regular expression pass over
+    # the newline-joined IP CIDRs, and only look for the offending IP CIDR on
+    # failure. An IP CIDR containing a newline would split into two lines
+    # that may each match, so those are rejected first.
+    if joined_ip_cidrs.count("\n") != len(ip_cidrs) - 1 or re.fullmatch(f"{IP_CIDR_PATTERN}(?:\n{IP_CIDR_PATTERN})*", joined_ip_cidrs) is None:
+        malformed = next(ip_cidr for ip_cidr in ip_cidrs if re.fullmatch(IP_CIDR_PATTERN, ip_cidr) is None)
+
+        raise ValueError(f"Malformed IP CIDR: {malformed}")
+
+    # Parsing one joined string in C is far cheaper than splitting each
+    # IP CIDR in Python.
+    fields = np.fromstring(".".join(ip_cidrs).replace("/", "."), dtype=np.uint32, sep=".")
+
+    # Older NumPy versions only warn and return a partial parse when the
+    # string cannot be read to its end.
+    if fields.size != 5 * len(ip_cidrs):
+        raise ValueError(f"Expected 5 numeric fields in each of {len(ip_cidrs)} IP CIDRs but found {fields.size} in total")
+
+    fields = fields.reshape(-1, 5)
+
+    if (fields[:, :4] > 255).any():
+        raise ValueError("Found IP address octet greater than 255")
+
+    if (fields[:, 4] > 32).any():
+        raise ValueError("Found IP CIDR mask greater than 32")
+
+    return fields
+
+def _octets_to_uint32(octets):
+    """
+    Converts an array with one row of four octets per IP address to an array
+    of numeric values.
+    """
+    return (octets[:, 0] << 24) | (octets[:, 1] << 16) | (octets[:, 2] << 8) | octets[:, 3]
+
+def _cidrs_to_uint32(ip_cidrs):
+    """
+    Parses IP CIDRs into parallel arrays of numeric prefix values and mask
+    lengths.
+    """
+    if parse_ip_cidrs is not None:
+        return parse_ip_cidrs(list(ip_cidrs))
+
+    fields = _parse_cidr_fields(ip_cidrs)
+
+    return (_octets_to_uint32(fields), fields[:, 4])
+
+def values_to_ips(values):
+    """
+    Converts an array of numeric values to a list of IP addresses.
+    """
+    octets = [((values >> shift) & 0xFF).tolist() for shift in (24, 16, 8, 0)]
+
+    return [f"{octet_1}.{octet_2}.{octet_3}.{octet_4}" for (octet_1, octet_2, octet_3, octet_4) in zip(*octets)]
+
+def ip_cidrs_to_ip_value_ranges(ip_cidrs):
+    """
+    Gets numeric values of min and max IP addresses for every IP CIDR in
+    `ip_cidrs`. Returns two parallel uint32 arrays of min and max values.
+    """
+    prefix_values, masks = _cidrs_to_uint32(ip_cidrs)
+
+    mask_values = NETWORK_MASKS[masks]
 
-    min_ip_addr = value_to_ip(min_value)
-    max_ip_addr = value_to_ip(max_value)
+    min_values = prefix_values & mask_values
+    max_values = min_values | ~mask_values
 
-    return (min_ip_addr, max_ip_addr)
+    return (min_values, max_values)
 
 def is_ip_in_cidr(ip_addr, ip_cidr):
     """
@@ -92,17 +187,7 @@ def value_to_ip(value):
     """
     Converts numeric value to an IP address and returns the result.
     """
-    octets = list()
-
-    v1 = sum([(1 << i) for i in range(8)])
-
-    for i in range(0, 32, 8):
-        v2 = (v1 << i)
-        octet = (value & v2) // (1 << i)
-
-        octets.append(str(octet))
-
-    return ".".join(reversed(octets))
+    return socket.inet_ntoa(struct.pack(">I", value))
 
 def get_ip_cidr_from_ips(ip_addrs):
     """
@@ -111,94 +196,190 @@ def get_ip_cidr_from_ips(ip_addrs):
 
     values = [get_value(ip_addr) for ip_addr in ip_addrs]
 
-    if all([ip_addr_1 == ip_addr_2 for (ip_addr_1, ip_addr_2) in itertools.product(values, values)]):
+    min_value = min(values)
+    max_value = max(values)
+
+    if min_value == max_value:
         return f"{ip_addrs[0]}/32"
 
-    i = 32
+    # Every value lies between the min and max values, so the common prefix of
+    # all of them is the common prefix of those two. It ends just above the
+    # highest bit in which they differ.
+    diff = min_value ^ max_value
 
-    mask = 0
+    mask_len = 32 - diff.bit_length()
 
-    while i > 0:
-        i -= 1
+    prefix = min_value & MASKS[mask_len][0]
 
-        if any([(value_1 & (1 << i)) != (value_2 & (1 << i)) for (value_1, value_2) in itertools.product(values, values)]):
-            break
+    return f"{value_to_ip(prefix)}/{mask_len}"
 
-        mask += (1 << i)
+@njit(cache=True)
+def _sweep(min_values, max_values):
+    """
+    Combines overlapping or adjacent IP ranges, which must be sorted by min
+    value, in a single pass. Returns arrays of min and max values of the
+    combined ranges along with how many of their leading entries are valid.
+    """
+    consolidated_min_values = np.empty_like(min_values)
+    consolidated_max_values = np.empty_like(max_values)
 
-    prefix = mask & values[0]
+    count = 0
 
-    return f"{value_to_ip(prefix)}/{32 - (i + 1)}"
+    for i in range(len(min_values)):
+        if count > 0 and np.int64(min_values[i]) <= np.int64(consolidated_max_values[count - 1]) + 1:
+            if max_values[i] > consolidated_max_values[count - 1]:
+                consolidated_max_values[count - 1] = max_values[i]
+        else:
+            consolidated_min_values[count] = min_values[i]
+            consolidated_max_values[count] = max_values[i]
+            count += 1
 
-def compare_ip_address_ranges(ip_range_1, ip_range_2):
-    """
-    Returns value determined by comparing lower bound of ip_range_1 to lower IP
-    bound of ip_range_2, conceptually comparing the lower bounds' octets'
-    numeric values from left to right.
-    """
-    return get_value(ip_range_1[0]) - get_value(ip_range_2[0])
+    return (consolidated_min_values, consolidated_max_values, count)
 
-def ip_ranges_overlap(ip_range_1, ip_range_2):
+@njit(cache=True)
+def _host_bits(low, high):
     """
-    Returns True if IP ranges overlap, False otherwise.
+    Gets the number of host bits of the largest IP CIDR that starts at numeric
+    value `low` and ends at or before numeric value `high`.
     """
-    return get_value(ip_range_1[1]) >= get_value(ip_range_2[0]) and get_value(ip_range_2[1]) >= get_value(ip_range_1[0])
+    host_bits = 0
 
-def sort_ip_address_ranges(ip_ranges):
+    while host_bits < 32 and (low >> host_bits) & 1 == 0 and low + (np.int64(1) << (host_bits + 1)) - 1 <= high:
+        host_bits += 1
+
+    return host_bits
+
+@njit(cache=True)
+def _split_ranges(min_values, max_values):
     """
-    Sort IP address ranges by comparing octets of lower bounds to IP ranges.
+    Splits each IP range into the fewest IP CIDRs that cover exactly that
+    range. Returns parallel arrays of prefix values and prefix lengths.
     """
-    return sorted(ip_ranges, key=functools.cmp_to_key(compare_ip_address_ranges))
+    # Count the CIDRs first so the output arrays can be allocated exactly.
+    count = 0
+
+    for i in range(len(min_values)):
+        low = np.int64(min_values[i])
+
+        while low <= np.int64(max_values[i]):
+            low += np.int64(1) << _host_bits(low, np.int64(max_values[i]))
+            count += 1
+
+    prefix_values = np.empty(count, dtype=np.uint32)
+    prefix_lengths = np.empty(count, dtype=np.uint8)
+
+    count = 0
+
+    for i in range(len(min_values)):
+        low = np.int64(min_values[i])
+
+        while low <= np.int64(max_values[i]):
+            host_bits = _host_bits(low, np.int64(max_values[i]))
+
+            prefix_values[count] = low
+            prefix_lengths[count] = 32 - host_bits
 
-def combine_ip_ranges(ip_range_1, ip_range_2):
+            low += np.int64(1) << host_bits
+            count += 1
+
+    return (prefix_values, prefix_lengths)
+
+def split_ranges_u32(min_values, max_values):
     """
-    Combines two IP ranges.
+    Splits IP ranges, given as parallel arrays of min and max numeric values,
+    into the fewest IP CIDRs that cover exactly those ranges. Returns parallel
+    arrays of numeric prefix values and prefix lengths, sorted by prefix
+    value if the ranges are sorted and non-overlapping.
     """
+    if HAVE_NUMBA:
+        return _split_ranges(min_values, max_values)
+
+    low_values = min_values.astype(np.int64)
+    high_values = max_values.astype(np.int64)
+    range_indexes = np.arange(len(min_values))
+
+    prefix_values = list()
+    prefix_lengths = list()
+    prefix_range_indexes = list()
+
+    # Emit one CIDR from the start of every unfinished range per iteration.
+    # Each step at least halves what is left of a range, so this runs at
+    # most 64 times.
+    while low_values.size:
+        # Largest power of two dividing `low` (2**32 for 0.0.0.0), and the
+        # largest power of two no greater than the rest of the range. frexp's
+        # exponent is one more than the base 2 logarithm of a power of two.
+        alignments = np.where(low_values == 0, np.int64(1) << 32, low_values & -low_values)
+        _, span_exponents = np.frexp((high_values - low_values + 1).astype(np.float64))
+
+        block_sizes = np.minimum(alignments, np.int64(1) << (span_exponents.astype(np.int64) - 1))
+        _, block_exponents = np.frexp(block_sizes.astype(np.float64))
+
+        prefix_values.append(low_values)
+        prefix_lengths.append(33 - block_exponents)
+        prefix_range_indexes.append(range_indexes)
+
+        low_values = low_values + block_sizes
+
+        unfinished = low_values <= high_values
 
-    if get_value(ip_range_1[0]) < get_value(ip_range_2[0]):
-        min_ip_range = ip_range_1[0]
-    else:
-        min_ip_range = ip_range_2[0]
+        low_values = low_values[unfinished]
+        high_values = high_values[unfinished]
+        range_indexes = range_indexes[unfinished]
 
-    if get_value(ip_range_1[1]) > get_value(ip_range_2[1]):
-        max_ip_range = ip_range_1[1]
-    else:
-        max_ip_range = ip_range_2[1]
+    if not prefix_values:
+        return (np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.uint8))
 
-    return [min_ip_range, max_ip_range]
+    prefix_values = np.concatenate(prefix_values)
+    prefix_lengths = np.concatenate(prefix_lengths)
 
-def consolidate_ip_ranges(ip_ranges):
+    # Restore range order, then address order within each range.
+    order = np.lexsort((prefix_values, np.concatenate(prefix_range_indexes)))
+
+    return (prefix_values[order].astype(np.uint32), prefix_lengths[order].astype(np.uint8))
+
+def consolidate_ranges_u32(min_values, max_values):
     """
-    Compute IP ranges, sort IP ranges, combine them by comparing the next
-    unprocessed range with only the last range added to the overall list of
-    non-overlapping ranges and adding to list if no overlap and combining with
-    previously added range if there is overlap.
+    Sorts IP ranges, given as parallel arrays of min and max numeric values,
+    by their min values, drops duplicates and combines overlapping or
+    adjacent ranges. A range starts a new group if its min value is more than
+    one greater than the max value of every range before it. Returns parallel
+    arrays of min and max values of the non-overlapping ranges.
     """
-    consolidated_ranges = []
+    if len(min_values) == 0:
+        return (min_values, max_values)
 
-    #print('\n'.join([str(_) for _ in sort_ip_address_ranges(ip_ranges)]))
+    # Pack each range into one 64-bit key so a single sort orders ranges by
+    # min value and brings duplicate ranges, which are common when combining
+    # several RIR dumps, next to each other to be dropped.
+    packed_ranges = np.sort((min_values.astype(np.uint64) << np.uint64(32)) | max_values.astype(np.uint64))
+    packed_ranges = packed_ranges[np.concatenate(([True], packed_ranges[1:] != packed_ranges[:-1]))]
 
-    for index, ip_range in enumerate(sort_ip_address_ranges(ip_ranges)):
-        last_consolidated_range = consolidated_ranges[-1] if consolidated_ranges else None
+    min_values = (packed_ranges >> np.uint64(32)).astype(np.uint32)
+    max_values = (packed_ranges & np.uint64(0xFFFFFFFF)).astype(np.uint32)
 
-        if last_consolidated_range and ip_ranges_overlap(ip_range, last_consolidated_range):
-            #print(f"Found overlapping ranges: {ip_range} and {last_consolidated_range}")
-            consolidated_ranges.pop()
-            consolidated_ranges.append(combine_ip_ranges(ip_range, last_consolidated_range))
-        else:
-            #print(f"Found no overlapping range: {ip_range} and {last_consolidated_range}")
-            consolidated_ranges.append(ip_range)
+    if HAVE_NUMBA:
+        consolidated_min_values, consolidated_max_values, count = _sweep(min_values, max_values)
+
+        return (consolidated_min_values[:count], consolidated_max_values[:count])
+
+    running_max = np.maximum.accumulate(max_values)
 
-    return consolidated_ranges
+    # Compare in 64 bits so that max + 1 cannot wrap around at 255.255.255.255.
+    group_starts = np.flatnonzero(np.concatenate(([True], min_values[1:].astype(np.int64) > running_max[:-1].astype(np.int64) + 1)))
+
+    return (min_values[group_starts], np.maximum.reduceat(max_values, group_starts))
 
 def consolidate_ip_cidrs(ip_cidrs):
-    ip_ranges = [ip_cidr_to_ip_range(ip_cidr) for ip_cidr in ip_cidrs]
+    min_values, max_values = ip_cidrs_to_ip_value_ranges(ip_cidrs)
+
+    print(f"Converted {len(ip_cidrs)} IP CIDRs to {len(min_values)} IP ranges")
 
-    print(f"Converted {len(ip_cidrs)} IP CIDRs to {len(ip_ranges)} IP ranges")
+    min_values, max_values = consolidate_ranges_u32(min_values, max_values)
 
-    consolidated_ranges = consolidate_ip_ranges(ip_ranges)
+    prefix_values, prefix_lengths = split_ranges_u32(min_values, max_values)
 
-    return [get_ip_cidr_from_ips(ip_range) for ip_range in consolidated_ranges]
+    return [f"{prefix_ip_addr}/{prefix_length}" for (prefix_ip_addr, prefix_length) in zip(values_to_ips(prefix_values), prefix_lengths.tolist())]
 
 def main():
     ip_cidr = "210.105.44.170/21" 
@@ -206,9 +387,9 @@ def main():
 
     print(is_ip_in_cidr(ip_addr, ip_cidr))
 
-    ip_range = ip_cidr_to_ip_range(ip_cidr)
+    min_value, max_value = ip_cidr_to_ip_value_range(ip_cidr)
 
-    print(ip_range)
+    print((value_to_ip(min_value), value_to_ip(max_value)))
 
     print(get_ip_cidr_from_ips(["192.168.43.0", "192.168.44.0", "192.168.45.0"]))
     print(get_ip_cidr_from_ips(["1.2.3.4", "1.2.3.4"]))
@@ -218,5 +399,12 @@ def main():
     print(get_ip_cidr_from_ips("1.2.3.4 - 1.2.3.4\n".split(" - ")))
     print(get_ip_cidr_from_ips("1.2.3.4 - 1.2.3.5".split(" - ")))
 
+    print(consolidate_ip_cidrs(["1.2.3.0/24", "1.2.4.0/24"]))
+    print(consolidate_ip_cidrs(["1.2.2.0/24", "1.2.3.0/24"]))
+    print(consolidate_ip_cidrs(["10.0.0.0/24", "10.0.1.0/24", "10.0.2.0/24"]))
+    print(consolidate_ip_cidrs(["255.255.255.255/32", "255.255.255.254/32"]))
+    print(consolidate_ip_cidrs(["0.0.0.0/0", "10.0.0.0/8"]))
+    print(consolidate_ip_cidrs(["10.0.0.0/8", "10.0.0.0/8", "10.1.0.0/16"]))
+
 if __name__ == "__main__":
     main()